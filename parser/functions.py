@@ -1,7 +1,9 @@
 from re import findall, sub
 from datetime import date
 from dateutil import parser
-from pandas import isna
+from pandas import isna, to_numeric, to_datetime
+from sqlalchemy import create_engine
+from sqlalchemy.types import Integer, Numeric, Boolean, DateTime, Date
 
 
 def create_url(**kwargs):
@@ -25,6 +27,23 @@ def create_url(**kwargs):
     return conn_str
 
 
+def create_db_engine(**kwargs):
+    """
+    create a SQLAlchemy engine out of config file parameters. Takes the same parameters as create_url, plus optional
+    pool_size and max_overflow entries for sizing the connection pool. SQL Server connections through pyodbc get
+    fast_executemany turned on so bulk inserts are sent as arrays instead of row by row.
+
+    """
+    url = create_url(**kwargs)
+    engine_args = {'pool_size': int(kwargs.get('pool_size', 5)),
+                   'max_overflow': int(kwargs.get('max_overflow', 10)),
+                   'pool_pre_ping': True}
+    if 'sqlserver' in kwargs['type'].lower() and 'pyodbc' in kwargs['driver'].lower():
+        engine_args['fast_executemany'] = True
+
+    return create_engine(url, **engine_args)
+
+
 def parse_camelcase(txt: str):
     """
     convert CamelCase to snake_case
@@ -124,3 +143,43 @@ def quoted_list(this_list: [str]):
     list_str = ','.join(quoted_items)
 
     return list_str
+
+
+def coerce_column(series, sql_type):
+    """
+    coerce a column of parsed XML strings to the native dtype of the SQL column it will be written to. If any non-null
+    value can't be converted the column is returned untouched, so nothing is silently turned into a null.
+
+    :param series: the pandas Series to be converted
+    :param sql_type: the SQLAlchemy type of the matching column in the database
+    :return: the converted Series and the number of values that couldn't be converted
+    """
+    present = series.notna()
+    if isinstance(sql_type, Boolean):
+        bool_map = {'true': True, 'false': False, '1': True, '0': False}
+        converted = series.map(lambda val: bool_map.get(str(val).strip().lower()) if not isna(val) else val)
+        dtype = 'boolean'
+    elif isinstance(sql_type, Integer):
+        converted = to_numeric(series, errors='coerce')
+        dtype = 'Int64'
+        # a float that doesn't round-trip to an int is just as bad as a string
+        converted = converted.where(converted.isna() | (converted % 1 == 0))
+    elif isinstance(sql_type, Numeric):
+        converted = to_numeric(series, errors='coerce')
+        dtype = 'float64'
+    elif isinstance(sql_type, (DateTime, Date)):
+        # convert_datetime has already shifted everything to local time, so the offset it leaves behind can go, and the
+        # number of fractional digits varies from value to value, so the format can't be inferred from the first one
+        local = series.map(lambda val: sub(r'[+-]\d{2}:\d{2}$', '', val) if isinstance(val, str) else val)
+        converted = to_datetime(local, errors='coerce', format='ISO8601')
+        dtype = None
+    else:
+        return series, 0
+
+    bad_values = int((present & converted.isna()).sum())
+    if bad_values > 0:
+        return series, bad_values
+
+    if dtype:
+        converted = converted.astype(dtype)
+    return converted, 0
@@ -1,8 +1,66 @@
+from io import StringIO
+
 import pandas as pd
-from sqlalchemy import MetaData
+from sqlalchemy import MetaData, exc, text
 from sqlalchemy.orm import Session
 
 
+def frame_rows(df):
+    """
+    turns a DataFrame into a list of row tuples with every kind of null (NaN, NaT, pd.NA) as None, which is what DBAPI
+    drivers expect
+    """
+    clean = df.astype(object).where(df.notna(), None)
+    return list(clean.itertuples(index=False, name=None))
+
+
+def copy_statement(table, columns):
+    """
+    the COPY statement used by copy_rows, with \\N as the null marker
+    """
+    return f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+
+
+def copy_rows(cursor, table, columns, df):
+    """
+    streams a DataFrame into a PostgreSQL table with COPY ... FROM STDIN, using an in-memory CSV buffer. Works with
+    both psycopg2 (copy_expert) and psycopg 3 (copy) cursors.
+
+    :param cursor: a DBAPI cursor
+    :param table: the quoted table name
+    :param columns: the quoted, comma separated column list
+    :param df: the data to be loaded, in the same column order as columns
+    :return: the number of rows sent
+    """
+    buffer = StringIO()
+    df.to_csv(buffer, index=False, header=False, na_rep='\\N')
+    buffer.seek(0)
+    statement = copy_statement(table, columns)
+
+    if hasattr(cursor, 'copy_expert'):
+        cursor.copy_expert(statement, buffer)
+    else:
+        with cursor.copy(statement) as copy:
+            copy.write(buffer.getvalue())
+    return len(df)
+
+
+def executemany_rows(cursor, statement, rows, batch_size):
+    """
+    sends rows to the database through cursor.executemany in batches of batch_size. With pyodbc's fast_executemany
+    turned on each batch goes over as a single parameter array, so the batch size caps how much the driver buffers.
+
+    :param cursor: a DBAPI cursor
+    :param statement: a parameterized INSERT statement
+    :param rows: a list of row tuples
+    :param batch_size: the number of rows per executemany call
+    :return: the number of rows sent
+    """
+    for start in range(0, len(rows), batch_size):
+        cursor.executemany(statement, rows[start:start + batch_size])
+    return len(rows)
+
+
 class FFIDatabase:
     """
     this represents everything you will need from an FFI database
@@ -15,6 +73,7 @@ class FFIDatabase:
         self.tables = self.meta.tables
         self._primary_keys = None
         self._foreign_keys = None
+        self._column_types = None
 
     def get_primary_keys(self):
         if not self._primary_keys:
@@ -36,6 +95,90 @@ class FFIDatabase:
 
         return self._foreign_keys
 
+    def get_column_types(self):
+        if not self._column_types:
+            types = {table: {column.name: column.type for column in self.tables[table].columns}
+                     for table in self.tables}
+            self._column_types = types
+
+        return self._column_types
+
+    def bulk_load(self, table, df, batch_size=5000, identity_insert=False):
+        """
+        Writes a DataFrame into a table using the fastest path the driver has. psycopg2 and psycopg 3 get COPY FROM
+        STDIN, pyodbc gets fast_executemany in batches, and any other driver falls back to a SQLAlchemy executemany.
+        Driver errors are re-raised as SQLAlchemy exceptions so callers can handle them like they would from to_sql.
+
+        :param table: the name of the table to load into
+        :param df: the data to load; columns need to match the table's column names
+        :param batch_size: rows per executemany call (ignored by COPY)
+        :param identity_insert: turn on IDENTITY_INSERT for the load (SQL Server only)
+        :return: the number of rows written
+        """
+        dialect = self.engine.dialect
+        preparer = dialect.identifier_preparer
+        table_name = preparer.quote(table)
+
+        # the fast paths use driver specific cursor features, so they're picked by driver rather than database
+        if dialect.driver in ('psycopg2', 'psycopg'):
+            columns = ', '.join(preparer.quote(col) for col in df.columns)
+            statement = copy_statement(table_name, columns)
+            load = lambda cursor: copy_rows(cursor, table_name, columns, df)
+        elif dialect.driver == 'pyodbc':
+            columns = ', '.join(preparer.quote(col) for col in df.columns)
+            placeholders = ', '.join('?' for _ in df.columns)
+            statement = f'INSERT INTO {table_name} ({columns}) VALUES ({placeholders})'
+            load = lambda cursor: executemany_rows(cursor, statement, frame_rows(df), batch_size)
+        else:
+            return self._executemany_load(table, df, batch_size, identity_insert)
+
+        identity_insert = identity_insert and dialect.name == 'mssql'
+        raw_conn = self.engine.raw_connection()
+        cursor = raw_conn.cursor()
+        try:
+            if identity_insert:
+                cursor.execute(f'SET IDENTITY_INSERT {table_name} ON')
+            if dialect.driver == 'pyodbc':
+                cursor.fast_executemany = True
+            written = load(cursor)
+            raw_conn.commit()
+        except dialect.dbapi.Error as e:
+            raw_conn.rollback()
+            raise exc.DBAPIError.instance(statement, None, e, dialect.dbapi.Error, dialect=dialect)
+        finally:
+            # a rollback doesn't undo SET options, and only one table per session can have IDENTITY_INSERT on, so it
+            # has to be turned off before the connection goes back to the pool
+            if identity_insert:
+                try:
+                    cursor.execute(f'SET IDENTITY_INSERT {table_name} OFF')
+                except dialect.dbapi.Error:
+                    raw_conn.invalidate()
+            cursor.close()
+            raw_conn.close()
+
+        return written
+
+    def _executemany_load(self, table, df, batch_size, identity_insert):
+        """
+        The fallback for bulk_load on drivers without a native bulk path: a SQLAlchemy executemany in batches
+        """
+        table_name = self.engine.dialect.identifier_preparer.quote(table)
+        identity_insert = identity_insert and self.engine.dialect.name == 'mssql'
+        records = df.astype(object).where(df.notna(), None).to_dict('records')
+
+        with self.engine.begin() as conn:
+            if identity_insert:
+                conn.execute(text(f'SET IDENTITY_INSERT {table_name} ON'))
+            try:
+                for start in range(0, len(records), batch_size):
+                    conn.execute(self.tables[table].insert(), records[start:start + batch_size])
+            finally:
+                # SET options outlive a rollback, so this has to run whether or not the inserts went through
+                if identity_insert:
+                    conn.execute(text(f'SET IDENTITY_INSERT {table_name} OFF'))
+
+        return len(records)
+
     def start_session(self):
         return Session(self.engine)
 
@@ -5,13 +5,13 @@ import pandas as pd
 from pandas import DataFrame, concat, options
 from re import findall
 from dateutil import parser
-from sqlalchemy import exc, text, sql, select, and_, or_
+from sqlalchemy import exc, text, sql, select, delete, and_, or_
 from sqlalchemy.dialects.mysql import insert
 from sqlalchemy.orm import Session
 from parser.server import FFIDatabase
 from numpy import nan
 from hashlib import sha256
-from parser.functions import strip_namespace, convert_datetime
+from parser.functions import strip_namespace, convert_datetime, coerce_column
 import xml.etree.ElementTree as ET
 import datetime
 
@@ -308,6 +308,129 @@ class FFIFile:
 
         self.many_tables = True
 
+    def match_schema(self, ffi_db: FFIDatabase):
+        """
+        Projects each table in the data map down to the columns that exist in the matching database table and coerces
+        each column to the dtype of its SQL column, using the types reflected by FFIDatabase. This needs to run after
+        to_many_tables(), since the pivoted tables don't exist until then. Tables that don't exist in the database at all
+        are removed from the data map.
+
+        Returns a report of every mismatch found so problems show up before anything is written to the database.
+        """
+
+        col_types = ffi_db.get_column_types()
+        report = {'missing_tables': [], 'dropped_columns': {}, 'uncoerced_columns': {}}
+
+        for table in self._data_map:
+            if table in self._excluded:
+                continue
+            if table not in col_types:
+                report['missing_tables'].append(table)
+                continue
+
+            df = self._data_map[table]
+            table_types = col_types[table]
+
+            extra_cols = [col for col in df.columns if col not in table_types]
+            if extra_cols:
+                report['dropped_columns'][table] = extra_cols
+                df = df.drop(columns=extra_cols)
+
+            bad_cols = {}
+            for col in df.columns:
+                df[col], bad_values = coerce_column(df[col], table_types[col])
+                if bad_values > 0:
+                    bad_cols[col] = bad_values
+            if bad_cols:
+                report['uncoerced_columns'][table] = bad_cols
+
+            self._data_map[table] = df
+
+        # there's nowhere to write these, so they're taken out of the file rather than failing later in tables_to_db
+        for table in report['missing_tables']:
+            del self._data_map[table]
+
+        if report['missing_tables']:
+            print(f"Skipping tables not in database: {report['missing_tables']}")
+        for table, cols in report['dropped_columns'].items():
+            print(f'Dropping columns from {table} not in database: {cols}')
+        for table, cols in report['uncoerced_columns'].items():
+            print(f'Unconvertible values in {table}, leaving as text: {cols}')
+
+        return report
+
+    @staticmethod
+    def _key_set(column):
+        """
+        Hashes a column of key values into a dict of normalized key -> original value, so GUIDs compare regardless of
+        case and IDs compare regardless of whether they were coerced to ints yet
+        """
+        return {str(key).upper(): key for key in column.dropna().unique().tolist()}
+
+    def check_references(self, ffi_db: FFIDatabase):
+        """
+        Checks every foreign key in the file before anything is written. Child keys are first resolved against the
+        parent tables in the file itself, and only the ones left over are looked up in the database, in one session
+        with batched IN queries.
+
+        Returns a report of orphaned keys as {table: {column: [keys]}}, which is empty if the file is clean.
+        """
+
+        fks = ffi_db.get_foreign_keys()
+        loaded = {table: df for table, df in self._data_map.items() if table not in self._excluded}
+
+        unresolved = {}  # (parent table, parent column) -> keys not found in the file
+        pending = []  # (table, column, parent table, parent column, keys not found in the file)
+        for table, df in loaded.items():
+            if table not in fks:
+                continue
+            for col, refs in fks[table].items():
+                if col not in df.columns:
+                    continue
+                child_keys = self._key_set(df[col])
+                for parent_table, parent_col in refs:
+                    if parent_table in loaded and parent_col in loaded[parent_table].columns:
+                        parent_keys = self._key_set(loaded[parent_table][parent_col])
+                    else:
+                        parent_keys = {}
+                    missing = {k: v for k, v in child_keys.items() if k not in parent_keys}
+                    if missing:
+                        pending.append((table, col, parent_table, parent_col, missing))
+                        unresolved.setdefault((parent_table, parent_col), {}).update(missing)
+
+        col_types = ffi_db.get_column_types()
+        found = {}
+        with ffi_db.start_session() as sesh:
+            for (parent_table, parent_col), keys in unresolved.items():
+                db_col = ffi_db.tables[parent_table].c[parent_col]
+
+                # keys are bound as the parent column's type; anything that won't convert can't be in the database
+                # and is left out of the lookup, so it ends up reported as an orphan
+                values = {}
+                for key, value in keys.items():
+                    converted, bad_values = coerce_column(pd.Series([value], dtype=object),
+                                                          col_types[parent_table][parent_col])
+                    if bad_values == 0:
+                        values[key] = converted.tolist()[0]
+
+                lookup = list(values.values())
+                db_keys = set()
+                for start in range(0, len(lookup), 1000):
+                    query = select(db_col).where(db_col.in_(lookup[start:start + 1000]))
+                    db_keys.update(sesh.execute(query).scalars())
+                db_strings = set(str(db_key).upper() for db_key in db_keys)
+                found[(parent_table, parent_col)] = set(key for key, value in values.items()
+                                                        if value in db_keys or key in db_strings)
+
+        report = {}
+        for table, col, parent_table, parent_col, missing in pending:
+            orphans = [v for k, v in missing.items() if k not in found[(parent_table, parent_col)]]
+            if orphans:
+                report.setdefault(table, {})[col] = orphans
+                print(f'{len(orphans)} keys in {table}.{col} not found in {parent_table}.{parent_col}')
+
+        return report
+
     def check_dups(self, ffi_server: FFIDatabase):
         tables = {'admin_unit': ffi_server.tables['RegistrationUnit'],
                   'project': ffi_server.tables['ProjectUnit'],
@@ -457,54 +580,94 @@ class FFIFile:
             with ffi_db.start_session() as sesh:
                 try:  # some tables have this constraint, some don't. But we need to turn it on if it does.
                     sesh.execute(text(f'SET IDENTITY_INSERT {table} ON'))
+                    sesh.execute(text(f'SET IDENTITY_INSERT {table} OFF'))
                     sesh.commit()
                 except exc.ProgrammingError:
                     ident = False
 
-            with ffi_db.start_session() as sesh:
-                print(f'Attempting to write {table} to database.')
-                try:
-                    filtered_table.to_sql(table, sesh.bind, if_exists='append', index=False)
-                except exc.DataError as e:
-                    print(e)
-                    print('Skipping.')
-                    pass
-                self._processed.append(table)
-                self._update_last_modified(self, sesh)
-                print(f'Wrote {len(filtered_table)} lines of {table} to database.')
+            print(f'Attempting to write {table} to database.')
+            try:
+                # IDENTITY_INSERT is per connection, so the bulk loader turns it on for the connection it writes with
+                written = ffi_db.bulk_load(table, filtered_table, identity_insert=ident)
+                print(f'Wrote {written} lines of {table} to database.')
+            except exc.DataError as e:
+                print(e)
+                print('Skipping.')
+            self._processed.append(table)
 
             with ffi_db.start_session() as sesh:
-                if ident:
-                    sesh.execute(text(f'SET IDENTITY_INSERT {table} OFF'))
+                self._update_last_modified(self, sesh)
         else:
             print(f'\nNo new data to add for {table}.')
 
+    def method_keys(self):
+        """
+        Returns the method GUIDs and IDs this file touches, from its Method table and the MM_Protocol_Method and
+        MM_Organization_Method rows it writes, so the MM method cleanup can be limited to the methods a batch actually
+        touched. MM rows can point at methods that are only in the database, so the Method table alone isn't enough.
+        """
+        key_cols = {'Method': ('Method_GUID', 'Method_ID'),
+                    'MM_Protocol_Method': ('MM_Method_GUID', 'MM_Method_ID'),
+                    'MM_Organization_Method': ('MM_Method_GUID', 'MM_Method_ID')}
+
+        guids = set()
+        ids = set()
+        for table, (guid_col, id_col) in key_cols.items():
+            if table not in self._data_map:
+                continue
+            df = self[table]
+            if guid_col in df.columns:
+                guids.update(df[guid_col].dropna().tolist())
+            if id_col in df.columns:
+                # IDs are left as text if match_schema couldn't coerce them, so skip anything that isn't a whole number
+                numeric_ids = pd.to_numeric(df[id_col], errors='coerce').dropna()
+                ids.update(int(method_id) for method_id in numeric_ids if method_id % 1 == 0)
+        return guids, ids
+
     @staticmethod
-    def remove_mm_method_problems(ffi_db):
-        protocol_method_q = """
-        DELETE FROM MM_Protocol_Method
-        WHERE MM_Method_ID IN (SELECT protocol.MM_Method_ID
-        FROM MM_Protocol_Method protocol
-        INNER JOIN Method ON protocol.MM_Method_GUID = Method.Method_GUID
-        WHERE protocol.MM_Method_GUID <> Method.Method_GUID
-        OR MM_Method_ID <> Method_ID)
+    def remove_mm_method_problems(ffi_db, method_guids, method_ids):
         """
+        Deletes MM_Protocol_Method and MM_Organization_Method rows whose method GUID and ID don't agree with the Method
+        table. This is meant to be run once per batch of files, and only looks at the methods passed in, which are
+        staged as bound key sets in chunks so the delete never scans the whole table.
 
-        org_method_q = """
-        DELETE FROM MM_Organization_Method
-        WHERE MM_Method_ID IN (SELECT org.MM_Method_ID
-        FROM MM_Organization_Method org
-        INNER JOIN Method ON org.MM_Method_ID = Method.Method_ID
-        WHERE org.MM_Method_GUID != Method.Method_GUID
-        OR MM_Method_ID <> Method_ID)
+        Returns the number of rows removed from each table.
         """
+        method = ffi_db.tables['Method']
+        protocol = ffi_db.tables['MM_Protocol_Method']
+        org = ffi_db.tables['MM_Organization_Method']
+        chunk = 1000
+
+        removed = {'MM_Protocol_Method': 0, 'MM_Organization_Method': 0}
+        guids = list(method_guids)
+        ids = list(method_ids)
 
         with ffi_db.start_session() as sick_sesh_bruh:
             print('Dropping Method mismatches.')
-            sick_sesh_bruh.execute(text(protocol_method_q))
-            sick_sesh_bruh.execute(org_method_q)
+            for start in range(0, len(guids), chunk):
+                staged = guids[start:start + chunk]
+                mismatched = select(protocol.c.MM_Method_ID)\
+                    .join(method, protocol.c.MM_Method_GUID == method.c.Method_GUID)\
+                    .where(protocol.c.MM_Method_GUID.in_(staged),
+                           protocol.c.MM_Method_ID != method.c.Method_ID)
+                query = delete(protocol).where(protocol.c.MM_Method_ID.in_(mismatched.scalar_subquery()))
+                removed['MM_Protocol_Method'] += sick_sesh_bruh.execute(query).rowcount
+
+            for start in range(0, len(ids), chunk):
+                staged = ids[start:start + chunk]
+                mismatched = select(org.c.MM_Method_ID)\
+                    .join(method, org.c.MM_Method_ID == method.c.Method_ID)\
+                    .where(org.c.MM_Method_ID.in_(staged),
+                           org.c.MM_Method_GUID != method.c.Method_GUID)
+                query = delete(org).where(org.c.MM_Method_ID.in_(mismatched.scalar_subquery()))
+                removed['MM_Organization_Method'] += sick_sesh_bruh.execute(query).rowcount
+
             sick_sesh_bruh.commit()
 
+        print(f"Removed {removed['MM_Protocol_Method']} MM_Protocol_Method and "
+              f"{removed['MM_Organization_Method']} MM_Organization_Method rows.")
+        return removed
+
     def tables_to_db(self, ffi_db):
         """
         Iterates through each table in the data map and inserts it into the database
@@ -0,0 +1,30 @@
+from re import sub
+
+import pandas as pd
+from sqlalchemy.types import DateTime, Integer
+
+from parser.functions import coerce_column, convert_datetime
+
+
+def test_coerce_datetime_mixed_precision():
+    # convert_datetime trims fractional seconds to a varying number of digits and may leave an offset on the end
+    raw = ['2019-06-01T16:00:00+00:00', '2019-06-01T16:00:00.1234567+00:00', None]
+    series = pd.Series([convert_datetime(val) for val in raw])
+
+    converted, bad_values = coerce_column(series, DateTime())
+
+    # how many fractional digits survive convert_datetime depends on the local timezone, so compare against its output
+    expected = [pd.Timestamp(sub(r'[+-]\d{2}:\d{2}$', '', val)) for val in series[:2]]
+    assert bad_values == 0
+    assert list(converted[:2]) == expected
+    assert converted[1].microsecond > 0
+    assert pd.isna(converted[2])
+
+
+def test_coerce_integer_leaves_bad_column_alone():
+    series = pd.Series(['5', '12.5', None])
+
+    converted, bad_values = coerce_column(series, Integer())
+
+    assert bad_values == 1
+    assert list(converted[:2]) == ['5', '12.5']
@@ -0,0 +1,165 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, event, exc, text
+from sqlalchemy.dialects.mssql import pyodbc as mssql_pyodbc
+
+from parser.server import FFIDatabase, copy_rows, executemany_rows, frame_rows
+
+
+class FakeCursor:
+    """
+    records what the loader sends instead of talking to a database
+    """
+
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.executed = []
+        self.batches = []
+        self.copied = None
+
+    def copy_expert(self, statement, buffer):
+        self.copied = (statement, buffer.read())
+
+    def execute(self, statement):
+        self.executed.append(statement)
+
+    def executemany(self, statement, rows):
+        if self.fail_on:
+            raise self.fail_on('bad row')
+        self.batches.append((statement, list(rows)))
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.committed = False
+        self.rolled_back = False
+
+    def cursor(self):
+        return self._cursor
+
+    def commit(self):
+        self.committed = True
+
+    def rollback(self):
+        self.rolled_back = True
+
+    def invalidate(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeDBAPIError(Exception):
+    pass
+
+
+class DataError(FakeDBAPIError):
+    pass
+
+
+def fake_database(cursor):
+    dialect = mssql_pyodbc.dialect()
+    dialect.dbapi = SimpleNamespace(Error=FakeDBAPIError)
+    connection = FakeConnection(cursor)
+    ffi_db = FFIDatabase.__new__(FFIDatabase)
+    ffi_db.engine = SimpleNamespace(dialect=dialect, raw_connection=lambda: connection)
+    return ffi_db, connection
+
+
+def test_frame_rows_nulls_to_none():
+    df = pd.DataFrame({'a': [1.5, np.nan],
+                       'b': pd.array([1, pd.NA], dtype='Int64'),
+                       'c': [pd.Timestamp('2020-01-01'), pd.NaT]})
+
+    rows = frame_rows(df)
+
+    assert rows[0] == (1.5, 1, pd.Timestamp('2020-01-01'))
+    assert rows[1] == (None, None, None)
+
+
+def test_copy_rows_statement_and_payload():
+    cursor = FakeCursor()
+    df = pd.DataFrame({'Plot_GUID': ['A1', None], 'Plot_Size': [2.5, np.nan]})
+
+    written = copy_rows(cursor, '"MacroPlot"', '"Plot_GUID", "Plot_Size"', df)
+
+    statement, payload = cursor.copied
+    assert written == 2
+    assert statement == 'COPY "MacroPlot" ("Plot_GUID", "Plot_Size") FROM STDIN WITH (FORMAT csv, NULL \'\\N\')'
+    assert payload.splitlines() == ['A1,2.5', '\\N,\\N']
+
+
+def test_executemany_rows_batches():
+    cursor = FakeCursor()
+    rows = [(i,) for i in range(7)]
+
+    written = executemany_rows(cursor, 'INSERT INTO t (a) VALUES (?)', rows, 3)
+
+    assert written == 7
+    assert [len(batch) for _, batch in cursor.batches] == [3, 3, 1]
+    assert [row for _, batch in cursor.batches for row in batch] == rows
+
+
+def test_bulk_load_identity_insert_off_after_failure():
+    cursor = FakeCursor(fail_on=DataError)
+    ffi_db, connection = fake_database(cursor)
+
+    with pytest.raises(exc.DataError):
+        ffi_db.bulk_load('Method', pd.DataFrame({'Method_ID': [1]}), identity_insert=True)
+
+    assert connection.rolled_back
+    assert cursor.executed == ['SET IDENTITY_INSERT [Method] ON', 'SET IDENTITY_INSERT [Method] OFF']
+
+
+def test_bulk_load_falls_back_to_executemany():
+    engine = create_engine('sqlite://')
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE Method (Method_ID INTEGER PRIMARY KEY, Method_Name TEXT)'))
+    ffi_db = FFIDatabase(engine)
+    df = pd.DataFrame({'Method_ID': pd.array([1, 2, 3], dtype='Int64'), 'Method_Name': ['a', None, 'c']})
+
+    written = ffi_db.bulk_load('Method', df, batch_size=2)
+
+    with engine.connect() as conn:
+        stored = conn.execute(text('SELECT Method_ID, Method_Name FROM Method ORDER BY Method_ID')).all()
+    assert written == 3
+    assert stored == [(1, 'a'), (2, None), (3, 'c')]
+
+
+def test_bulk_load_fallback_identity_insert():
+    engine = create_engine('sqlite://')
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE Method (Method_ID INTEGER PRIMARY KEY, Method_Name TEXT)'))
+    ffi_db = FFIDatabase(engine)
+    engine.dialect.name = 'mssql'  # a non-pyodbc SQL Server driver, as far as bulk_load can tell
+
+    # SQLite doesn't know SET IDENTITY_INSERT, so record it and run a no-op instead
+    identity_statements = []
+
+    @event.listens_for(engine, 'before_cursor_execute', retval=True)
+    def record_identity(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('SET IDENTITY_INSERT'):
+            identity_statements.append(statement)
+            return 'SELECT 1', ()
+        return statement, parameters
+
+    df = pd.DataFrame({'Method_ID': [1, 2, 3], 'Method_Name': ['a', 'b', 'c']})
+    written = ffi_db.bulk_load('Method', df, batch_size=2, identity_insert=True)
+
+    with pytest.raises(exc.IntegrityError):
+        ffi_db.bulk_load('Method', df, identity_insert=True)
+
+    with engine.connect() as conn:
+        stored = conn.execute(text('SELECT COUNT(*) FROM Method')).scalar()
+    assert written == 3
+    assert stored == 3
+    assert identity_statements == ['SET IDENTITY_INSERT "Method" ON', 'SET IDENTITY_INSERT "Method" OFF'] * 2
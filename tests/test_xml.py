@@ -0,0 +1,102 @@
+import pandas as pd
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.types import Integer
+
+from parser.functions import coerce_column
+from parser.server import FFIDatabase
+from parser.xml import FFIFile
+
+
+def ffi_file(data_map):
+    """
+    builds an FFIFile around tables that are already parsed, skipping the XML
+    """
+    ffi_data = FFIFile.__new__(FFIFile)
+    ffi_data._data_map = data_map
+    ffi_data._excluded = []
+    return ffi_data
+
+
+def method_database():
+    engine = create_engine('sqlite://')
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE Method (Method_ID INTEGER PRIMARY KEY)'))
+        conn.execute(text('CREATE TABLE Child (Child_ID INTEGER PRIMARY KEY, '
+                          'Method_ID INTEGER REFERENCES Method (Method_ID))'))
+        conn.execute(text('INSERT INTO Method (Method_ID) VALUES (5)'))
+    return FFIDatabase(engine)
+
+
+def test_match_schema_projects_and_reports():
+    server = method_database()
+    ffi_data = ffi_file({'Child': pd.DataFrame({'Child_ID': ['1', '2'], 'Method_ID': ['5', 'x'], 'Extra': ['a', 'b']}),
+                         'NotInDatabase': pd.DataFrame({'Col': ['1']})})
+
+    report = ffi_data.match_schema(server)
+
+    assert report == {'missing_tables': ['NotInDatabase'],
+                      'dropped_columns': {'Child': ['Extra']},
+                      'uncoerced_columns': {'Child': {'Method_ID': 1}}}
+    child = ffi_data['Child']
+    assert list(ffi_data._data_map) == ['Child']
+    assert list(child.columns) == ['Child_ID', 'Method_ID']
+    assert str(child['Child_ID'].dtype) == 'Int64'
+    assert list(child['Method_ID']) == ['5', 'x']
+
+def test_check_references_integer_parent_in_database():
+    server = method_database()
+    method_ids, _ = coerce_column(pd.Series(['5', '7']), Integer())
+    ffi_data = ffi_file({'Child': pd.DataFrame({'Child_ID': [1, 2], 'Method_ID': method_ids})})
+
+    report = ffi_data.check_references(server)
+
+    assert report == {'Child': {'Method_ID': [7]}}
+
+
+def test_check_references_parent_in_file():
+    server = method_database()
+    ffi_data = ffi_file({'Method': pd.DataFrame({'Method_ID': ['7']}),
+                         'Child': pd.DataFrame({'Child_ID': ['1'], 'Method_ID': ['7']})})
+
+    assert ffi_data.check_references(server) == {}
+
+
+def test_method_keys_skips_unconverted_ids():
+    ffi_data = ffi_file({'Method': pd.DataFrame({'Method_GUID': ['A', 'B', 'C'], 'Method_ID': ['3', '12.5', 'x']})})
+
+    assert ffi_data.method_keys() == ({'A', 'B', 'C'}, {3})
+
+
+def test_remove_mm_method_problems_only_touched_methods():
+    engine = create_engine('sqlite://')
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE Method (Method_ID INTEGER PRIMARY KEY, Method_GUID TEXT)'))
+        conn.execute(text('CREATE TABLE MM_Protocol_Method (MM_Method_ID INTEGER, MM_Method_GUID TEXT)'))
+        conn.execute(text('CREATE TABLE MM_Organization_Method (MM_Method_ID INTEGER, MM_Method_GUID TEXT)'))
+        conn.execute(text("INSERT INTO Method VALUES (1, 'A'), (2, 'B'), (3, 'C')"))
+        # every protocol row and the organization rows for 1 and 3 are mismatched, but the batch only touched method
+        # A (in its Method table) and method B (only through an MM_Protocol_Method row)
+        conn.execute(text("INSERT INTO MM_Protocol_Method VALUES (9, 'A'), (8, 'B'), (7, 'C')"))
+        conn.execute(text("INSERT INTO MM_Organization_Method VALUES (1, 'Z'), (2, 'B'), (3, 'Y')"))
+    server = FFIDatabase(engine)
+    ffi_data = ffi_file({'Method': pd.DataFrame({'Method_GUID': ['A'], 'Method_ID': ['1']}),
+                         'MM_Protocol_Method': pd.DataFrame({'MM_Method_GUID': ['B'], 'MM_Method_ID': ['8']})})
+
+    removed = FFIFile.remove_mm_method_problems(server, *ffi_data.method_keys())
+
+    assert removed == {'MM_Protocol_Method': 2, 'MM_Organization_Method': 1}
+    with engine.connect() as conn:
+        assert conn.execute(text('SELECT MM_Method_GUID FROM MM_Protocol_Method')).scalars().all() == ['C']
+        assert conn.execute(text('SELECT MM_Method_ID FROM MM_Organization_Method')).scalars().all() == [2, 3]
+
+
+def test_check_references_unconvertible_key_is_orphan():
+    server = method_database()
+    ffi_data = ffi_file({'Child': pd.DataFrame({'Child_ID': ['1', '2'], 'Method_ID': ['5', 'x']})})
+    ffi_data.match_schema(server)  # leaves Method_ID as text because of 'x'
+    bound = []
+    event.listen(server.engine, 'before_cursor_execute',
+                 lambda conn, cursor, statement, parameters, context, executemany: bound.extend(parameters))
+
+    assert ffi_data.check_references(server) == {'Child': {'Method_ID': ['x']}}
+    assert bound == [5]
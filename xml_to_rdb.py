@@ -1,7 +1,6 @@
 import configparser
-from sqlalchemy import create_engine
 from parser.xml import *
-from parser.functions import create_url
+from parser.functions import create_db_engine
 from parser.server import FFIDatabase
 
 
@@ -18,34 +17,51 @@ def main():
     config.read('config.ini')
 
     sql_config = config['NameOfYourServer']
-    sql_url = create_url(**sql_config)
-    sql_engine = create_engine(sql_url)
+    sql_engine = create_db_engine(**sql_config)
     server = FFIDatabase(sql_engine)
 
     if not os.path.isdir(processed := os.path.join(path, 'processed')):
         os.mkdir(processed)
 
     xml_files = [f for f in os.scandir(path) if f.is_file() and '.xml' in f.path]
+    method_guids = set()
+    method_ids = set()
 
-    for export in xml_files:
+    try:
+        for export in xml_files:
 
-        file = export.path
-        print(f'\nReading in {export}')
-        ffi_data = FFIFile(export)
+            file = export.path
+            print(f'\nReading in {export}')
+            ffi_data = FFIFile(export)
 
-        if debug:
-            new_map = {'TableYouWantToTest': ffi_data['TableYouWantToTest']}
-            ffi_data._data_map = new_map
-            ffi_data.version = '1'
+            if debug:
+                new_map = {'TableYouWantToTest': ffi_data['TableYouWantToTest']}
+                ffi_data._data_map = new_map
+                ffi_data.version = '1'
 
-        if '1.05.13' in ffi_data.version or '1.05.08' in ffi_data.version:
-            print(f'Converting to MT format.')
-            ffi_data.to_many_tables()
+            if '1.05.13' in ffi_data.version or '1.05.08' in ffi_data.version:
+                print(f'Converting to MT format.')
+                ffi_data.to_many_tables()
 
-        ffi_data.tables_to_db(server)
-        ffi_data.remove_mm_method_problems(server)
+            ffi_data.match_schema(server)
+            if ffi_data.check_references(server):
+                print(f'Skipping {export.name}: orphaned foreign keys, nothing was written.')
+                continue
 
-        os.rename(file, os.path.join(processed, export))
+            # collected before writing so a file that fails partway through still gets cleaned up
+            guids, ids = ffi_data.method_keys()
+            method_guids.update(guids)
+            method_ids.update(ids)
+            ffi_data.tables_to_db(server)
+
+            os.rename(file, os.path.join(processed, export))
+    finally:
+        # one targeted cleanup for the whole batch instead of full table scans after every file. It runs even if a
+        # file fails, so the files written before it still get cleaned up
+        try:
+            FFIFile.remove_mm_method_problems(server, method_guids, method_ids)
+        except Exception as e:  # don't let a cleanup failure hide the error that stopped the batch
+            print(f'Method cleanup failed: {e}')
 
 
 if __name__ == "__main__":